@@ -0,0 +1,421 @@
+# ==============================
+# 🏷 PyMentor - Batch Title Backfill
+# Finds chats without a real title ("New Chat", timestamp names,
+# pre-v4 chats stored as a plain message list) and generates
+# their titles in one offline batch.
+#
+# Usage:
+#   python pymentor_backfill_titles.py --mode batch     # OpenAI Batch API
+#   python pymentor_backfill_titles.py --mode local     # thread pool stand-in
+#
+# The job is resumable: progress is kept in STATE_PATH, so running
+# it again after an interruption picks up where it stopped.
+# Applying results is idempotent: a title is only written if the
+# chat is still untitled and its first question is unchanged.
+# Safe to run while the app is serving: chats and the title index
+# are rewritten under the same lock file the app uses.
+# ==============================
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from openai import OpenAI
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+# Same locations as pymentorv4.py
+CHAT_DIR = "chats"
+CHAT_INDEX_PATH = "chat_index.json"
+CHAT_LOCK_PATH = "chats.lock"
+
+# Progress of the current backfill run
+STATE_PATH = "title_backfill_state.json"
+
+# Title model and prompt (same as generate_chat_title in pymentorv4.py)
+TITLE_MODEL = "gpt-4.1-mini"
+TITLE_PROMPT = (
+    "Generate a short title (max 5 words) "
+    "based on user message. "
+    "Do not use quotes."
+)
+
+# Only the start of the first question is needed for a title
+MAX_QUESTION_CHARS = 2000
+
+# USD per 1M tokens for TITLE_MODEL (update if pricing changes)
+PRICE_INPUT_PER_M = 0.40
+PRICE_OUTPUT_PER_M = 1.60
+
+# Batch API requests are billed at half price
+BATCH_DISCOUNT = 0.5
+
+# Seconds between batch status checks
+POLL_SECONDS = 30
+
+# Chat files named after their creation timestamp
+TIMESTAMP_TITLE = re.compile(r"^\d{8}_\d{6}(_\d{6})?(\.json)?$")
+
+
+# ==============================
+# 📂 Chat Helpers
+# ==============================
+
+def load_json(path, default=None):
+    """
+    Load a JSON file, or return `default` if it does not exist.
+    """
+    if not os.path.exists(path):
+        return default
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_json(path, data, indent=None):
+    """
+    Write JSON via a temp file so readers never see half a file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=indent)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Exclusive lock on `path` (same lock as file_lock in pymentorv4.py).
+    """
+    with open(path, "a+") as f:
+        if os.name == "nt":
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def normalize_chat(data):
+    """
+    Pre-v4 chats are a plain list of messages; wrap them
+    in the v4 {"title", "messages"} structure.
+    """
+    if isinstance(data, list):
+        return {"title": "New Chat", "messages": data}
+    return data
+
+
+def is_untitled(title):
+    """
+    True for default titles and timestamp file names.
+    """
+    return not title or title == "New Chat" or bool(TIMESTAMP_TITLE.match(title))
+
+
+def first_question(data):
+    """
+    First user message of a chat, or None.
+    """
+    for msg in data["messages"]:
+        if msg["role"] == "user" and msg["content"].strip():
+            return msg["content"][:MAX_QUESTION_CHARS]
+    return None
+
+
+def fingerprint(question):
+    """
+    Identifies the question a title was generated for.
+    """
+    return hashlib.sha1(question.encode("utf-8")).hexdigest()
+
+
+def find_untitled_chats():
+    """
+    Return {chat file: first question} for every untitled chat.
+    Read without the app's lock: the app saves chats atomically, and
+    chats deleted or unreadable meanwhile are skipped (apply_results
+    re-checks each chat under the lock anyway).
+    """
+    untitled = {}
+    for f in sorted(os.listdir(CHAT_DIR)):
+        if not f.endswith(".json"):
+            continue
+
+        try:
+            data = load_json(os.path.join(CHAT_DIR, f))
+        except (OSError, ValueError):
+            continue
+        if data is None:
+            continue
+
+        data = normalize_chat(data)
+        question = first_question(data)
+        if question and is_untitled(data["title"]):
+            untitled[f] = question
+
+    return untitled
+
+
+# ==============================
+# 💾 Resumable State
+# ==============================
+
+def load_state():
+    """
+    Load progress from a previous (possibly interrupted) run.
+    """
+    return load_json(STATE_PATH, default={"batch_id": None, "results": {}, "applied": []})
+
+
+def save_state(state):
+    """
+    Persist progress after every step.
+    """
+    write_json(STATE_PATH, state, indent=4)
+
+
+# ==============================
+# 🤖 Title Generation
+# ==============================
+
+def title_request(question):
+    """
+    Request body for one title (Responses API).
+    """
+    return {
+        "model": TITLE_MODEL,
+        "input": [
+            {"role": "system", "content": TITLE_PROMPT},
+            {"role": "user", "content": question},
+        ],
+    }
+
+
+def response_text(body):
+    """
+    Extract output text from a raw Responses API body.
+    """
+    parts = []
+    for item in body.get("output", []):
+        for content in item.get("content") or []:
+            if content.get("type") == "output_text":
+                parts.append(content["text"])
+    return "".join(parts).strip()
+
+
+def run_local(client, pending, state, concurrency):
+    """
+    Local stand-in for the Batch API: a bounded thread pool.
+    Each result is saved to the state file as soon as it arrives.
+    """
+    lock = threading.Lock()
+
+    def generate(chat_file, question):
+        response = client.responses.create(**title_request(question))
+        return chat_file, question, response
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(generate, f, q) for f, q in pending.items()]
+
+        for future in as_completed(futures):
+            try:
+                chat_file, question, response = future.result()
+            except Exception as e:
+                print(f"  ⚠️ {e}")
+                continue
+
+            with lock:
+                state["results"][chat_file] = {
+                    "title": response.output_text.strip(),
+                    "fingerprint": fingerprint(question),
+                    "input_tokens": response.usage.input_tokens,
+                    "output_tokens": response.usage.output_tokens,
+                }
+                save_state(state)
+
+
+def run_batch(client, pending, state):
+    """
+    Submit all pending titles as one Batch API job (or resume
+    the job from the state file), wait for it and collect results.
+    """
+    if state["batch_id"] is None:
+        lines = [
+            json.dumps({
+                "custom_id": chat_file,
+                "method": "POST",
+                "url": "/v1/responses",
+                "body": title_request(question),
+            })
+            for chat_file, question in pending.items()
+        ]
+
+        batch_file = client.files.create(
+            file=("titles.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch"
+        )
+        batch = client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/responses",
+            completion_window="24h"
+        )
+
+        state["batch_id"] = batch.id
+        state["fingerprints"] = {f: fingerprint(q) for f, q in pending.items()}
+        save_state(state)
+        print(f"📤 Submitted batch {batch.id} with {len(lines)} titles")
+
+    # Wait for the batch (safe to interrupt: the id is in the state file)
+    while True:
+        batch = client.batches.retrieve(state["batch_id"])
+        if batch.status in ("completed", "failed", "expired", "cancelled"):
+            break
+        counts = batch.request_counts
+        print(f"  ⏳ {batch.status}" + (f" ({counts.completed}/{counts.total})" if counts else ""))
+        time.sleep(POLL_SECONDS)
+
+    if batch.output_file_id:
+        output = client.files.content(batch.output_file_id).text
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+
+            body = response["body"]
+            state["results"][result["custom_id"]] = {
+                "title": response_text(body),
+                "fingerprint": state["fingerprints"].get(result["custom_id"]),
+                "input_tokens": body["usage"]["input_tokens"],
+                "output_tokens": body["usage"]["output_tokens"],
+            }
+
+    print(f"📥 Batch {batch.status}")
+
+    # A finished batch is never polled again
+    state["batch_id"] = None
+    save_state(state)
+
+
+# ==============================
+# ✅ Apply Results
+# ==============================
+
+def apply_results(state):
+    """
+    Write generated titles into the chats and the title index.
+    Skips chats that were titled, changed or deleted meanwhile.
+
+    Each chat is re-read and rewritten under the app's lock, so
+    turns (and titles) the app saves meanwhile are never lost.
+    """
+    applied = set(state["applied"])
+
+    for chat_file, result in state["results"].items():
+        path = os.path.join(CHAT_DIR, chat_file)
+        if chat_file in applied or not result["title"]:
+            continue
+
+        with file_lock(CHAT_LOCK_PATH):
+            if os.path.exists(path):
+                data = normalize_chat(load_json(path))
+                question = first_question(data)
+
+                if is_untitled(data["title"]) and question and fingerprint(question) == result["fingerprint"]:
+                    data["title"] = result["title"]
+                    write_json(path, data, indent=4)
+
+                    index = load_json(CHAT_INDEX_PATH, default={})
+                    index[chat_file] = result["title"]
+                    write_json(CHAT_INDEX_PATH, index)
+
+        applied.add(chat_file)
+
+    state["applied"] = sorted(applied)
+    save_state(state)
+
+
+def print_report(state, generated, elapsed, mode):
+    """
+    Print throughput of this run and estimated cost per 1,000 titles.
+    """
+    results = list(state["results"].values())
+    if not results:
+        print("No titles generated.")
+        return
+
+    input_tokens = sum(r["input_tokens"] for r in results)
+    output_tokens = sum(r["output_tokens"] for r in results)
+    cost = (input_tokens * PRICE_INPUT_PER_M + output_tokens * PRICE_OUTPUT_PER_M) / 1_000_000
+    if mode == "batch":
+        cost *= BATCH_DISCOUNT
+
+    print(f"🏷 Titles: {len(results)} | Applied: {len(state['applied'])}")
+    print(f"⚡ Throughput: {generated / elapsed:.1f} titles/s ({generated} titles in {elapsed:.1f}s)")
+    print(f"💰 Tokens: {input_tokens} in / {output_tokens} out "
+          f"| ~${cost:.4f} total | ~${cost / len(results) * 1000:.3f} per 1,000 titles")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate titles for untitled PyMentor chats.")
+    parser.add_argument("--mode", choices=["batch", "local"], default="batch",
+                        help="OpenAI Batch API or a local thread pool")
+    parser.add_argument("--concurrency", type=int, default=4, help="Parallel requests in local mode")
+    parser.add_argument("--dry-run", action="store_true", help="Only list untitled chats")
+    args = parser.parse_args()
+
+    state = load_state()
+    untitled = find_untitled_chats()
+
+    # Anything already generated (in an earlier run) is not requested again
+    pending = {f: q for f, q in untitled.items() if f not in state["results"]}
+    print(f"🔎 Untitled chats: {len(untitled)} | Still to generate: {len(pending)}")
+
+    if args.dry_run:
+        for chat_file, question in pending.items():
+            print(f"  {chat_file}: {question[:60]!r}")
+        return
+
+    load_dotenv()
+    client = OpenAI()
+    start = time.perf_counter()
+    done_before = len(state["results"])
+
+    if pending or state["batch_id"]:
+        if args.mode == "batch":
+            run_batch(client, pending, state)
+        else:
+            run_local(client, pending, state, args.concurrency)
+
+    apply_results(state)
+    print_report(state, len(state["results"]) - done_before, time.perf_counter() - start, args.mode)
+
+    # Everything applied: start fresh next time
+    if not state["batch_id"] and set(state["results"]) <= set(state["applied"]):
+        os.remove(STATE_PATH)
+
+
+if __name__ == "__main__":
+    main()
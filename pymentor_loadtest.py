@@ -0,0 +1,322 @@
+# ==============================
+# 🏋️ PyMentor - Load Testing Harness
+# Drives N simulated sessions against pymentorv4.py
+# using Streamlit's AppTest and a local fake streaming backend.
+#
+# AppTest keeps global state while a script runs, so each
+# session runs in its own process. All sessions share the same
+# chats/ directory, so storage contention is real, but
+# st.cache_resource caches are per process (not shared as they
+# would be inside one Streamlit server).
+#
+# Usage:
+#   python pymentor_loadtest.py --sessions 1,5,10,20 --questions 3
+#
+# Reports per level:
+# - Rerun latency percentiles (p50 / p95 / p99)
+# - Throughput (reruns per second)
+# - Memory: peak RSS of each session process (mostly imports and
+#   AppTest setup) and its growth after the first run (the session)
+# - Storage contention (time in file I/O spans + storage errors)
+# - Steps skipped because the session could not perform them
+# ==============================
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from json import JSONDecodeError
+from types import SimpleNamespace
+from unittest import mock
+
+try:
+    import resource  # POSIX only
+except ImportError:
+    resource = None
+
+import openai
+from streamlit.testing.v1 import AppTest
+
+
+# App under test (resolved before we change working directory)
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pymentorv4.py")
+
+# Spans (from the admin profiling panel) that touch chat storage
+STORAGE_SPANS = ["load_titles", "load_chat", "save_chat"]
+
+# Questions sent by simulated students
+QUESTIONS = [
+    "How do Python list comprehensions work?",
+    "What is the difference between a tuple and a list?",
+    "Explain Python decorators with an example",
+    "How do I read a file line by line in Python?",
+    "What does the yield keyword do?",
+]
+
+
+# ==============================
+# 🤖 Fake Streaming Backend
+# ==============================
+
+class FakeResponses:
+    """
+    Stand-in for client.responses: streams canned tokens
+    with a fixed delay, and returns a short title otherwise.
+    """
+
+    def __init__(self, tokens, token_delay):
+        self.tokens = tokens
+        self.token_delay = token_delay
+
+    def create(self, model, input, stream=False, **kwargs):
+        if not stream:
+            return SimpleNamespace(output_text="Load Test Chat")
+        return self.stream_events(model)
+
+    def stream_events(self, model):
+        for i in range(self.tokens):
+            time.sleep(self.token_delay)
+            yield SimpleNamespace(type="response.output_text.delta", delta=f"token{i} ")
+
+        usage = SimpleNamespace(input_tokens=50, output_tokens=self.tokens)
+        yield SimpleNamespace(type="response.completed", response=SimpleNamespace(usage=usage))
+
+
+class FakeClient:
+    """
+    Stand-in for openai.OpenAI.
+    """
+
+    def __init__(self, tokens, token_delay):
+        self.responses = FakeResponses(tokens, token_delay)
+
+
+# ==============================
+# 👩‍🎓 Simulated Session
+# ==============================
+
+def timed_run(at, latencies):
+    """
+    Run the script once and record its wall time.
+    """
+    start = time.perf_counter()
+    at.run()
+    latencies.append(time.perf_counter() - start)
+
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+
+def is_storage_error(message):
+    """
+    Errors caused by sessions racing on chats/ (partial reads,
+    files deleted or overwritten by another session).
+    """
+    return any(name in message for name in (
+        JSONDecodeError.__name__,
+        FileNotFoundError.__name__,
+        "Expecting value",
+        "No such file or directory",
+        ".json' is not in list",  # chat deleted by another session
+        "reused chat ID",
+    ))
+
+
+def click(buttons, label):
+    """
+    Click the first button whose label contains `label`.
+    """
+    next(b for b in buttons if label in b.label).click()
+
+
+def run_session(session_id, options):
+    """
+    One student: open app, new chat, ask questions,
+    switch chats, delete the chat. Runs in a worker process.
+    """
+    os.chdir(options["work_dir"])
+    os.environ["PYMENTOR_ADMIN"] = "1"  # spans give per-session storage timings
+
+    fake_client = FakeClient(options["tokens"], options["token_delay"])
+    with mock.patch.object(openai, "OpenAI", lambda *a, **kw: fake_client):
+        return simulate_student(session_id, options["questions"], options["timeout"])
+
+
+def simulate_student(session_id, questions, timeout):
+    """
+    Drive one AppTest session through a typical student flow.
+    """
+    latencies = []
+    result = {
+        "latencies": latencies, "errors": [], "skipped": [],
+        "storage_errors": 0, "storage_seconds": 0.0, "rss_mb": 0.0, "memory_mb": 0.0,
+    }
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+    try:
+        timed_run(at, latencies)
+        # The first run pays for imports and AppTest setup
+        rss_warm = peak_rss_mb()
+        first_chat = at.session_state["current_chat"]
+
+        click(at.sidebar.button, "New Chat")
+        timed_run(at, latencies)
+
+        if at.session_state["current_chat"] == first_chat:
+            raise RuntimeError(f"New Chat reused chat ID {first_chat}")
+
+        for i in range(questions):
+            at.text_area[0].input(QUESTIONS[(session_id + i) % len(QUESTIONS)])
+            click(at.button, "Ask PyMentor")
+            timed_run(at, latencies)
+
+        # Switch to another chat and back
+        chat_select = at.sidebar.selectbox[0]
+        if len(chat_select.options) > 1:
+            current = chat_select.index
+            chat_select.select_index(1 if current == 0 else 0)
+            timed_run(at, latencies)
+            at.sidebar.selectbox[0].select_index(current)
+            timed_run(at, latencies)
+        else:
+            result["skipped"].append(f"session {session_id}: switch chats (only one chat listed)")
+
+        click(at.sidebar.button, "Delete Chat")
+        timed_run(at, latencies)
+
+        result["memory_mb"] = max(0.0, peak_rss_mb() - rss_warm)
+
+    except Exception as e:
+        result["errors"].append(f"session {session_id}: {type(e).__name__}: {e}")
+        if is_storage_error(str(e)):
+            result["storage_errors"] += 1
+
+    result["rss_mb"] = peak_rss_mb()
+
+    spans = at.session_state["span_stats"] if "span_stats" in at.session_state else {}
+    result["storage_seconds"] = sum(spans[name]["total"] for name in STORAGE_SPANS if name in spans)
+    return result
+
+
+# ==============================
+# 📈 Load Levels & Report
+# ==============================
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of values.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process in MB, or 0 where
+    the resource module is missing (Windows).
+    """
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports KB
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_level(sessions, options):
+    """
+    Run `sessions` concurrent sessions and summarize.
+    """
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=sessions) as pool:
+        results = list(pool.map(run_session, range(sessions), [options] * sessions))
+
+    wall = time.perf_counter() - start
+    latencies = [t for r in results for t in r["latencies"]]
+    errors = [e for r in results for e in r["errors"]]
+    storage = [r["storage_seconds"] for r in results]
+
+    return {
+        "sessions": sessions,
+        "reruns": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "throughput": len(latencies) / wall if wall else 0.0,
+        "rss_mb": statistics.mean(r["rss_mb"] for r in results),
+        "mem_per_session_mb": statistics.mean(r["memory_mb"] for r in results),
+        "storage_ms_per_session": statistics.mean(storage) * 1000 if storage else 0.0,
+        "storage_errors": sum(r["storage_errors"] for r in results),
+        "errors": errors,
+        "skipped": [s for r in results for s in r["skipped"]],
+    }
+
+
+def print_report(rows):
+    """
+    Print one line per load level, then any errors and skipped steps.
+    RSS is the whole worker process (imports, AppTest, app caches);
+    +MB is its growth after the first run, i.e. the session itself.
+    """
+    print()
+    print(f"{'N':>4} {'reruns':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rerun/s':>8} "
+          f"{'RSS MB':>8} {'+MB/sess':>9} {'I/O ms/sess':>12} {'I/O err':>8} {'errors':>7} {'skipped':>8}")
+
+    for row in rows:
+        print(f"{row['sessions']:>4} {row['reruns']:>7} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} "
+              f"{row['p99_ms']:>9.1f} {row['throughput']:>8.2f} {row['rss_mb']:>8.1f} "
+              f"{row['mem_per_session_mb']:>9.2f} {row['storage_ms_per_session']:>12.1f} "
+              f"{row['storage_errors']:>8} {len(row['errors']):>7} {len(row['skipped']):>8}")
+
+    for row in rows:
+        for error in row["errors"]:
+            print(f"  N={row['sessions']}: {error}")
+        for step in row["skipped"]:
+            print(f"  N={row['sessions']} skipped: {step}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test PyMentor with simulated sessions.")
+    parser.add_argument("--sessions", default="1,5,10,20", help="Comma-separated session counts")
+    parser.add_argument("--questions", type=int, default=3, help="Questions asked per session")
+    parser.add_argument("--tokens", type=int, default=60, help="Tokens per fake answer")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="Seconds between fake tokens")
+    parser.add_argument("--timeout", type=float, default=120, help="Max seconds per rerun")
+    parser.add_argument("--keep-dir", action="store_true", help="Keep the temp chats directory")
+    args = parser.parse_args()
+
+    # Run against a scratch directory so real chats are never touched
+    work_dir = tempfile.mkdtemp(prefix="pymentor_loadtest_")
+    options = {
+        "questions": args.questions,
+        "tokens": args.tokens,
+        "token_delay": args.token_delay,
+        "timeout": args.timeout,
+    }
+
+    rows = []
+    for sessions in [int(n) for n in args.sessions.split(",")]:
+        print(f"▶ {sessions} concurrent session(s)...")
+
+        # Fresh storage per level, so earlier levels' chats don't count
+        level_dir = os.path.join(work_dir, f"level_{sessions}")
+        os.makedirs(level_dir)
+        rows.append(run_level(sessions, {**options, "work_dir": level_dir}))
+
+    print_report(rows)
+
+    if args.keep_dir:
+        print(f"\nChats kept in {work_dir}")
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
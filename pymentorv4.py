@@ -7,15 +7,292 @@
 # - Streaming AI Response
 # - Temperature & Model Control
 # - Persistent Chat Storage (JSON)
+# - Usage Analytics Dashboard
+# - Related Past Answers (local vector index)
+# - Admin Profiling Panel
+# - Stop Generation (keeps partial reply)
+# - Fragment-Scoped Reruns
+# - Side-by-Side Model Comparison
 # ==============================
 
+import numpy as np
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from streamlit.runtime.scriptrunner_utils.exceptions import ScriptControlException
 from openai import OpenAI
 from dotenv import load_dotenv
+import cProfile
 import json
 import os
+import queue
+import re
+import threading
 import time
-from datetime import datetime
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+# ==============================
+# ⏱ Profiling Spans
+# ==============================
+
+# Enable the admin panel with PYMENTOR_ADMIN=1 (server-side only)
+ADMIN_ENV_VAR = "PYMENTOR_ADMIN"
+
+# Directory where cProfile captures are written
+PROFILE_DIR = "profiles"
+
+# Older captures are deleted beyond this count
+PROFILE_KEEP = 20
+
+# A capture running longer than this was abandoned (session closed
+# mid-run) and may be taken over by another session
+PROFILE_STALE_SECONDS = 300
+
+# Shared no-op context used when spans are disabled
+NO_SPAN = nullcontext()
+
+
+def profiling_enabled():
+    """
+    Spans are only recorded for admins. Visitors cannot turn
+    this on: it is set where the server is started.
+    """
+    return os.getenv(ADMIN_ENV_VAR) == "1"
+
+
+@st.cache_resource
+def get_profiler_slot():
+    """
+    The one cProfile capture allowed per process (Python 3.12+
+    raises ValueError for a second one): its profiler and start time.
+    """
+    return {"profiler": None, "started": 0.0, "lock": threading.Lock()}
+
+
+def start_profiler():
+    """
+    Profile this run unless another session's capture is running.
+    Returns False if the slot is taken.
+    """
+    slot = get_profiler_slot()
+    with slot["lock"]:
+        if slot["profiler"] is not None and time.time() - slot["started"] > PROFILE_STALE_SECONDS:
+            # Its session never finished the run: reclaim the slot
+            slot["profiler"].disable()
+            slot["profiler"] = None
+
+        if slot["profiler"] is not None:
+            return False
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        slot.update(profiler=profiler, started=time.time())
+
+    st.session_state.active_profiler = profiler
+    return True
+
+
+@st.cache_resource
+def get_process_spans():
+    """
+    Span totals aggregated across all sessions in this process.
+    """
+    return {"stats": {}, "lock": threading.Lock()}
+
+
+def add_span(stats, name, seconds):
+    """
+    Add one timing to a {name: count/total/max} table.
+    """
+    entry = stats.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+    entry["count"] += 1
+    entry["total"] += seconds
+    entry["max"] = max(entry["max"], seconds)
+
+
+def record_span(name, seconds):
+    """
+    Record a span for this session and for the whole process.
+    """
+    add_span(st.session_state.setdefault("span_stats", {}), name, seconds)
+
+    process = get_process_spans()
+    with process["lock"]:
+        add_span(process["stats"], name, seconds)
+
+
+@contextmanager
+def timed_span(name):
+    """
+    Context manager that records how long its block took.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+
+def span(name):
+    """
+    Time a phase of the script run. Costs one flag check when disabled.
+    """
+    if not SPANS_ENABLED:
+        return NO_SPAN
+    return timed_span(name)
+
+
+def stop_profiler():
+    """
+    Stop an active cProfile capture and write it to PROFILE_DIR.
+    Open the .prof file with snakeviz for a flamegraph-style view.
+    """
+    profiler = st.session_state.pop("active_profiler", None)
+    if profiler is None:
+        return
+
+    slot = get_profiler_slot()
+    with slot["lock"]:
+        # Unless another session reclaimed it as stale meanwhile
+        if slot["profiler"] is profiler:
+            profiler.disable()
+            slot["profiler"] = None
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"rerun_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.prof")
+    profiler.dump_stats(path)
+    st.session_state.last_profile = path
+
+    captures = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith(".prof"))
+    for f in captures[:-PROFILE_KEEP]:
+        os.remove(os.path.join(PROFILE_DIR, f))
+
+
+def finish_run():
+    """
+    Close the spans for this script run.
+    Must be called before every st.rerun / st.stop and at the end.
+    """
+    # RUN_START is only set by full runs; fragment runs have their own spans
+    if SPANS_ENABLED and not in_fragment_rerun():
+        record_span("script_run", time.perf_counter() - RUN_START)
+    stop_profiler()
+
+
+def in_fragment_rerun():
+    """
+    True when only a fragment (not the whole script) is running.
+    """
+    ctx = get_script_run_ctx()
+    return ctx is not None and bool(ctx.fragment_ids_this_run)
+
+
+def rerun(scope="app"):
+    """
+    Rerun the whole script (after finishing profiling),
+    or only the fragment that is currently running.
+    """
+    # Fragment reruns are only allowed during a fragment run
+    if scope == "fragment" and not in_fragment_rerun():
+        scope = "app"
+
+    if scope == "app":
+        finish_run()
+    st.rerun(scope=scope)
+
+
+def fragment_span(name):
+    """
+    Time a fragment. Fragment-only reruns are recorded separately,
+    so they can be compared with full script runs.
+    """
+    if in_fragment_rerun():
+        return span(f"fragment_rerun:{name}")
+    return span(f"fragment:{name}")
+
+
+def span_rows(stats):
+    """
+    Span table rows sorted by total time.
+    """
+    return [
+        {
+            "span": name,
+            "count": entry["count"],
+            "avg_ms": round(entry["total"] / entry["count"] * 1000, 2),
+            "max_ms": round(entry["max"] * 1000, 2),
+            "total_ms": round(entry["total"] * 1000, 1),
+        }
+        for name, entry in sorted(stats.items(), key=lambda item: -item[1]["total"])
+    ]
+
+
+def render_admin_panel():
+    """
+    Sidebar panel with span timings and on-demand cProfile capture.
+    """
+    with st.sidebar.expander("🛠 Admin: Profiling"):
+        st.caption("This session")
+        st.dataframe(span_rows(st.session_state.get("span_stats", {})), hide_index=True)
+
+        process = get_process_spans()
+        with process["lock"]:
+            rows = span_rows(process["stats"])
+        st.caption("All sessions")
+        st.dataframe(rows, hide_index=True)
+
+        if st.button("📸 Profile Next Rerun"):
+            st.session_state.profile_next = True
+
+        if "last_profile" in st.session_state:
+            st.caption(f"Last profile: `{st.session_state.last_profile}`")
+
+
+RUN_START = time.perf_counter()
+SPANS_ENABLED = profiling_enabled()
+
+# A capture left over from an interrupted run is closed first
+stop_profiler()
+
+# Profile this whole run if requested from the admin panel
+if st.session_state.pop("profile_next", False):
+    if not start_profiler():
+        st.toast("⚠️ Another session is being profiled. Try again in a moment.")
+
+
+# ==============================
+# 🔒 Cross-Process File Lock
+# ==============================
+
+@contextmanager
+def file_lock(path):
+    """
+    Exclusive lock on `path`, shared with other processes
+    (other servers, the load test, the title backfill job).
+    """
+    with open(path, "a+") as f:
+        if os.name == "nt":
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f, fcntl.LOCK_UN)
 
 
 # ==============================
@@ -33,17 +310,20 @@ os.makedirs(CHAT_DIR, exist_ok=True)
 # 🔐 Initialize OpenAI Client
 # ==============================
 
+@st.cache_resource
 def get_open_ai_client():
     """
     Load environment variables and return OpenAI client.
     Make sure your API key is stored in .env file.
+    Built once per process and shared by all sessions.
     """
     load_dotenv()
     return OpenAI()
 
 
 # Create client instance
-client = get_open_ai_client()
+with span("client"):
+    client = get_open_ai_client()
 
 
 # ==============================
@@ -53,10 +333,11 @@ client = get_open_ai_client()
 def new_chat():
     """
     Creates a new chat file with:
-    - Unique timestamp ID
+    - Unique timestamp ID (microseconds, so concurrent sessions
+      creating chats in the same second get different files)
     - Default system prompt
     """
-    chat_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+    chat_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
     file_path = os.path.join(CHAT_DIR, f"{chat_id}.json")
 
     # Initial chat structure
@@ -82,12 +363,238 @@ def new_chat():
 # 💾 Save Chat to File
 # ==============================
 
-def save_chat(path, data):
+def save_chat(path, data, usage=None):
     """
     Save chat data (title + messages) into JSON file.
+    If usage stats are given, update the analytics store too.
+
+    Written via a temp file, so other sessions and the title
+    backfill job never read half a chat.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with file_lock(CHAT_LOCK_PATH):
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, path)
+
+    set_chat_title(os.path.basename(path), data["title"])
+
+    if usage is not None:
+        record_usage(usage)
+
+
+# ==============================
+# 📊 Usage Analytics Store
+# ==============================
+
+# Rollups file, updated on every save (never rebuilt from chats/)
+ANALYTICS_PATH = "analytics.json"
+
+# Held while a process reads, updates and rewrites the rollups
+ANALYTICS_LOCK_PATH = "analytics.json.lock"
+
+# Keep hourly buckets for the last 7 days; daily buckets are kept forever
+HOURLY_RETENTION_HOURS = 24 * 7
+
+# Counters tracked per bucket and model
+USAGE_COUNTERS = [
+    "chats",
+    "turns",
+    "input_tokens",
+    "output_tokens",
+    "latency_seconds",
+    "refusals",
+    "cancellations",
+    "tokens_saved",
+    "seconds_saved",
+    # Part of output_tokens / latency_seconds from stopped replies
+    "stopped_output_tokens",
+    "stopped_latency_seconds",
+]
+
+
+def empty_analytics():
+    """
+    Empty analytics structure: hourly, daily and total rollups.
+    """
+    return {"hourly": {}, "daily": {}, "totals": {}}
+
+
+# No spinner: it is also used while a stopped run saves its partial reply
+@st.cache_resource(show_spinner=False)
+def get_analytics_store():
+    """
+    In-memory copy of the rollups, shared by all sessions of this
+    process and reloaded when another process changes the file.
+    """
+    return {"data": empty_analytics(), "mtime": None, "lock": threading.Lock()}
+
+
+def refresh_analytics(store, force=False):
+    """
+    Reload the rollups if the file changed (caller holds the lock).
+    A missing or corrupt file counts as empty.
+    """
+    if not os.path.exists(ANALYTICS_PATH):
+        store["data"], store["mtime"] = empty_analytics(), None
+        return
+
+    mtime = os.path.getmtime(ANALYTICS_PATH)
+    if not force and mtime == store["mtime"]:
+        return
+
+    try:
+        with open(ANALYTICS_PATH, "r") as f:
+            data = json.load(f)
+    except ValueError:
+        data = None
+
+    if not isinstance(data, dict):
+        data = empty_analytics()
+    for key, value in empty_analytics().items():
+        data.setdefault(key, value)
+
+    store["data"], store["mtime"] = data, mtime
+
+
+def add_usage(bucket, model, usage):
+    """
+    Add one turn's usage to a {model: counters} bucket.
+    """
+    counters = bucket.setdefault(model, {})
+    for key in USAGE_COUNTERS:
+        counters.setdefault(key, 0)
+
+    counters["chats"] += 1 if usage["new_chat"] else 0
+    counters["turns"] += 1
+    counters["input_tokens"] += usage["input_tokens"]
+    counters["output_tokens"] += usage["output_tokens"]
+    counters["latency_seconds"] += usage["latency_seconds"]
+    counters["refusals"] += 1 if usage["refusal"] else 0
+
+    # Stopped early: estimate what the full answer would have cost
+    if usage.get("truncated"):
+        counters["cancellations"] += 1
+        counters["stopped_output_tokens"] += usage["output_tokens"]
+        counters["stopped_latency_seconds"] += usage["latency_seconds"]
+        counters["tokens_saved"] += usage["tokens_saved"]
+        counters["seconds_saved"] += usage["seconds_saved"]
+
+
+def record_usage(usage):
+    """
+    Update hourly/daily/total rollups for one turn and persist them.
+    """
+    now = datetime.now()
+    hour_key = now.strftime("%Y-%m-%d %H:00")
+    day_key = now.strftime("%Y-%m-%d")
+    oldest_hour = (now - timedelta(hours=HOURLY_RETENTION_HOURS)).strftime("%Y-%m-%d %H:00")
+
+    store = get_analytics_store()
+
+    # Re-read under the file lock so other processes' counts are kept
+    with store["lock"], file_lock(ANALYTICS_LOCK_PATH):
+        refresh_analytics(store, force=True)
+        data = store["data"]
+        add_usage(data["hourly"].setdefault(hour_key, {}), usage["model"], usage)
+        add_usage(data["daily"].setdefault(day_key, {}), usage["model"], usage)
+        add_usage(data["totals"], usage["model"], usage)
+
+        # Drop expired hourly buckets
+        for key in [k for k in data["hourly"] if k < oldest_hour]:
+            del data["hourly"][key]
+
+        # Write to a temp file first so a crash never leaves half a file
+        tmp_path = f"{ANALYTICS_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, ANALYTICS_PATH)
+        store["mtime"] = os.path.getmtime(ANALYTICS_PATH)
+
+
+def estimate_savings(usage):
+    """
+    Estimate tokens and seconds saved by stopping a reply early,
+    using this model's average completed reply so far.
     """
-    with open(path, "w") as f:
-        json.dump(data, f, indent=4)
+    store = get_analytics_store()
+    with store["lock"]:
+        refresh_analytics(store)
+        c = dict(store["data"]["totals"].get(usage["model"], {}))
+
+    # Stopped replies are shorter and would drag the average down
+    completed = c.get("turns", 0) - c.get("cancellations", 0)
+    tokens = c.get("output_tokens", 0) - c.get("stopped_output_tokens", 0)
+    seconds = c.get("latency_seconds", 0.0) - c.get("stopped_latency_seconds", 0.0)
+    avg_tokens = tokens / completed if completed > 0 else 0
+    avg_seconds = seconds / completed if completed > 0 else 0.0
+
+    usage["tokens_saved"] = max(0, round(avg_tokens - usage["output_tokens"]))
+    usage["seconds_saved"] = max(0.0, avg_seconds - usage["latency_seconds"])
+
+
+def render_analytics_dashboard():
+    """
+    Show usage rollups. Reads only the precomputed store,
+    so it costs the same no matter how many chats exist.
+    """
+    store = get_analytics_store()
+    with store["lock"]:
+        refresh_analytics(store)
+        totals = {m: dict(c) for m, c in store["data"]["totals"].items()}
+        daily = {d: {m: dict(c) for m, c in b.items()} for d, b in store["data"]["daily"].items()}
+        hourly = {h: {m: dict(c) for m, c in b.items()} for h, b in store["data"]["hourly"].items()}
+
+    st.subheader("📊 Usage Analytics")
+
+    if not totals:
+        st.info("No usage recorded yet.")
+        return
+
+    turns = sum(c["turns"] for c in totals.values())
+    latency = sum(c["latency_seconds"] for c in totals.values())
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Chats", sum(c["chats"] for c in totals.values()))
+    col2.metric("Turns", turns)
+    col3.metric("Tokens", sum(c["input_tokens"] + c["output_tokens"] for c in totals.values()))
+    col4.metric("Avg Latency", f"{latency / turns:.1f}s" if turns else "-")
+
+    cancellations = sum(c.get("cancellations", 0) for c in totals.values())
+    if cancellations:
+        st.caption(
+            f"⏹ {cancellations} replies stopped early, saving about "
+            f"{sum(c.get('tokens_saved', 0) for c in totals.values())} output tokens and "
+            f"{sum(c.get('seconds_saved', 0.0) for c in totals.values()):.0f}s"
+        )
+
+    # Per-day / per-model table
+    rows = []
+    for day in sorted(daily, reverse=True):
+        for model_name, c in sorted(daily[day].items()):
+            rows.append({
+                "day": day,
+                "model": model_name,
+                "chats": c["chats"],
+                "turns": c["turns"],
+                "input_tokens": c["input_tokens"],
+                "output_tokens": c["output_tokens"],
+                "avg_latency_s": round(c["latency_seconds"] / c["turns"], 2) if c["turns"] else 0,
+                "refusals": c["refusals"],
+                "stopped": c.get("cancellations", 0),
+            })
+    st.dataframe(rows)
+
+    # Turns per hour (last 7 days)
+    hours = sorted(hourly)
+    st.bar_chart(
+        {
+            "hour": hours,
+            "turns": [sum(c["turns"] for c in hourly[h].values()) for h in hours],
+        },
+        x="hour",
+        y="turns",
+    )
 
 
 # ==============================
@@ -138,182 +645,1007 @@ def load_chat(path):
 
 def list_chats():
     """
-    Return list of all chat files sorted by latest first.
+    Return list of all chat files sorted by latest first
+    (skipping temp files of a save in progress).
+    """
+    return sorted((f for f in os.listdir(CHAT_DIR) if f.endswith(".json")), reverse=True)
+
+
+# ==============================
+# 🗂 Chat Title Index
+# ==============================
+
+# {chat file: title}, so the sidebar never has to open every chat
+CHAT_INDEX_PATH = "chat_index.json"
+
+# Held while a chat file or the title index is rewritten
+# (shared with pymentor_backfill_titles.py)
+CHAT_LOCK_PATH = "chats.lock"
+
+
+# No spinner: it is also used while a stopped run saves its partial reply
+@st.cache_resource(show_spinner=False)
+def get_chat_index():
+    """
+    Process-wide title index. Reloaded only when the file on
+    disk changes (e.g. written by another process).
+    """
+    return {"titles": {}, "mtime": None, "lock": threading.Lock()}
+
+
+def refresh_chat_index(index):
+    """
+    Reload the index if it changed on disk (caller holds both locks).
+    """
+    if not os.path.exists(CHAT_INDEX_PATH):
+        return
+
+    mtime = os.path.getmtime(CHAT_INDEX_PATH)
+    if mtime != index["mtime"]:
+        with open(CHAT_INDEX_PATH, "r") as f:
+            index["titles"] = json.load(f)
+        index["mtime"] = mtime
+
+
+def write_chat_index(index):
+    """
+    Persist the index via a temp file (caller holds both locks).
+    """
+    tmp_path = f"{CHAT_INDEX_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index["titles"], f)
+    os.replace(tmp_path, CHAT_INDEX_PATH)
+    index["mtime"] = os.path.getmtime(CHAT_INDEX_PATH)
+
+
+def set_chat_title(file_name, title):
+    """
+    Record a chat's title (called on every save).
+    """
+    index = get_chat_index()
+    with index["lock"], file_lock(CHAT_LOCK_PATH):
+        refresh_chat_index(index)
+        if index["titles"].get(file_name) != title:
+            index["titles"][file_name] = title
+            write_chat_index(index)
+
+
+def remove_chat_title(file_name):
+    """
+    Drop a deleted chat from the index.
+    """
+    index = get_chat_index()
+    with index["lock"], file_lock(CHAT_LOCK_PATH):
+        refresh_chat_index(index)
+        if index["titles"].pop(file_name, None) is not None:
+            write_chat_index(index)
+
+
+def get_chat_titles():
+    """
+    Return chat files (newest first) and their titles.
+    Only chats missing from the index are opened.
+    """
+    chat_files = list_chats()
+    index = get_chat_index()
+
+    with index["lock"], file_lock(CHAT_LOCK_PATH):
+        refresh_chat_index(index)
+        titles = index["titles"]
+
+        missing = [f for f in chat_files if f not in titles]
+        for f in missing:
+            titles[f] = load_chat(os.path.join(CHAT_DIR, f))["title"]
+
+        stale = set(titles) - set(chat_files)
+        for f in stale:
+            del titles[f]
+
+        if missing or stale:
+            write_chat_index(index)
+
+        return chat_files, dict(titles)
+
+
+# ==============================
+# 🔎 Related Answers Index
+# ==============================
+
+# Local, offline index of past Q/A pairs (no network calls)
+INDEX_DIR = "index"
+VECTORS_PATH = os.path.join(INDEX_DIR, "answers.f32")
+META_PATH = os.path.join(INDEX_DIR, "answers.jsonl")
+
+# Size of the hashed feature space
+EMBED_DIM = 1024
+
+# Bytes per stored vector (float32)
+ROW_BYTES = EMBED_DIM * 4
+
+# Held while appending to or rebuilding the index files
+INDEX_LOCK_PATH = os.path.join(INDEX_DIR, "answers.lock")
+
+# Ignore matches below this cosine similarity
+MIN_SIMILARITY = 0.35
+
+# Max characters of a past answer injected as context
+RELATED_CONTEXT_CHARS = 600
+
+
+def embed_text(text):
+    """
+    Hashing vectorizer: words + word bigrams hashed into
+    EMBED_DIM buckets with log-scaled counts, L2 normalized.
+    """
+    words = re.findall(r"[a-z0-9_]+", text.lower())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    vector = np.zeros(EMBED_DIM, dtype=np.float32)
+    for feature in features:
+        h = zlib.crc32(feature.encode("utf-8"))
+        sign = 1.0 if (h >> 31) & 1 else -1.0
+        vector[h % EMBED_DIM] += sign
+
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def embed_pair(question, answer):
+    """
+    Embed a Q/A pair. The question is weighted higher since
+    new questions are matched against it.
+    """
+    vector = 2 * embed_text(question) + embed_text(answer)
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).astype(np.float32)
+
+
+def open_index_matrix(rows):
+    """
+    Memory-map the first `rows` vectors from disk.
+    """
+    if rows == 0:
+        return None
+    return np.memmap(VECTORS_PATH, dtype=np.float32, mode="r", shape=(rows, EMBED_DIM))
+
+
+def append_to_index(chat_id, question, answer, answer_at):
+    """
+    Append one Q/A pair to the on-disk index (caller holds the
+    file lock). Metadata holds only the vector row and where the
+    answer is in its chat; the text stays in the chat file.
+    """
+    # A crash mid-write can leave a partial row: overwrite it
+    exists = os.path.exists(VECTORS_PATH)
+    row = os.path.getsize(VECTORS_PATH) // ROW_BYTES if exists else 0
+    with open(VECTORS_PATH, "r+b" if exists else "wb") as f:
+        f.truncate(row * ROW_BYTES)
+        f.seek(row * ROW_BYTES)
+        f.write(embed_pair(question, answer).tobytes())
+
+    entry = {"row": row, "chat_id": chat_id, "answer_at": answer_at}
+    with open(META_PATH, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def rebuild_index():
+    """
+    Build the index from all saved chats.
+    Only runs when no index exists yet (caller holds the file lock).
+    """
+    for f in list_chats():
+        data = load_chat(os.path.join(CHAT_DIR, f))
+        chat_messages = data["messages"]
+
+        for i, (question, answer) in enumerate(zip(chat_messages, chat_messages[1:]), start=1):
+            if question["role"] == "user" and answer["role"] == "assistant":
+                append_to_index(f.replace(".json", ""), question["content"], answer["content"], i)
+
+
+def needs_rebuild():
+    """
+    True if the index is missing or from an older format
+    (one that copied question and answer text into the metadata).
+    """
+    if not (os.path.exists(META_PATH) and os.path.exists(VECTORS_PATH)):
+        return True
+
+    with open(META_PATH, "r") as f:
+        first = f.readline()
+    return bool(first.strip()) and "answer_at" not in first
+
+
+def refresh_answer_index(index):
+    """
+    Pick up rows appended by any process since the last call
+    (caller holds the lock). Only new metadata lines are read.
+    """
+    meta_size = os.path.getsize(META_PATH) if os.path.exists(META_PATH) else 0
+    if meta_size < index["meta_offset"]:
+        # Index was rebuilt by another process: start over
+        index.update(by_row={}, meta_offset=0)
+
+    if meta_size > index["meta_offset"]:
+        with open(META_PATH, "rb") as f:
+            f.seek(index["meta_offset"])
+            data = f.read(meta_size - index["meta_offset"])
+
+        # A line still being written has no newline yet
+        complete = data[:data.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                entry = None
+
+            # Deleted chat: drop its rows (a new dict, readers may hold the old one)
+            if isinstance(entry, dict) and "deleted" in entry:
+                index["by_row"] = {
+                    r: e for r, e in index["by_row"].items() if e["chat_id"] != entry["deleted"]
+                }
+            elif isinstance(entry, dict):
+                index["by_row"][entry["row"]] = entry
+
+        index["meta_offset"] += len(complete)
+
+    rows = os.path.getsize(VECTORS_PATH) // ROW_BYTES if os.path.exists(VECTORS_PATH) else 0
+    if rows != index["rows"]:
+        index["rows"] = rows
+        index["matrix"] = open_index_matrix(rows)
+
+
+@st.cache_resource
+def get_answer_index():
+    """
+    Per-process view of the index files, refreshed whenever
+    another process (or server) appends to them.
     """
-    return sorted(os.listdir(CHAT_DIR), reverse=True)
+    os.makedirs(INDEX_DIR, exist_ok=True)
+
+    with file_lock(INDEX_LOCK_PATH):
+        if needs_rebuild():
+            # Start clean so vectors and metadata stay aligned
+            for path in (VECTORS_PATH, META_PATH):
+                if os.path.exists(path):
+                    os.remove(path)
+            rebuild_index()
+
+    index = {"by_row": {}, "meta_offset": 0, "rows": 0, "matrix": None, "lock": threading.Lock()}
+    refresh_answer_index(index)
+    return index
+
+
+def index_answer(chat_id, messages):
+    """
+    Add the chat's last Q/A pair to the index (called after each save).
+    """
+    index = get_answer_index()
+    with index["lock"], file_lock(INDEX_LOCK_PATH):
+        append_to_index(chat_id, messages[-2]["content"], messages[-1]["content"], len(messages) - 1)
+        refresh_answer_index(index)
+
+
+def forget_chat_answers(chat_id):
+    """
+    Tombstone a deleted chat so no process matches its rows again.
+    """
+    index = get_answer_index()
+    with index["lock"], file_lock(INDEX_LOCK_PATH):
+        with open(META_PATH, "a") as f:
+            f.write(json.dumps({"deleted": chat_id}) + "\n")
+        refresh_answer_index(index)
+
+
+def find_related_answers(question, exclude_chat=None, k=3):
+    """
+    Return the top-k most similar past Q/A pairs from other chats.
+    """
+    index = get_answer_index()
+    with index["lock"]:
+        refresh_answer_index(index)
+        matrix = index["matrix"]
+        by_row = index["by_row"]
+
+    if matrix is None:
+        return []
+
+    scores = np.asarray(matrix @ embed_text(question))
+
+    # Take a few extra candidates since some get filtered out
+    count = min(len(scores), k * 3)
+    candidates = np.argpartition(-scores, count - 1)[:count]
+
+    related = []
+    for i in sorted(candidates, key=lambda i: -scores[i]):
+        # Rows without metadata (crash leftovers) are never matched
+        entry = by_row.get(int(i))
+        if entry is None or scores[i] < MIN_SIMILARITY or entry["chat_id"] == exclude_chat:
+            continue
+        # Text comes from the chat itself (skip chats deleted meanwhile)
+        try:
+            chat_messages = load_chat(os.path.join(CHAT_DIR, f"{entry['chat_id']}.json"))["messages"]
+        except (FileNotFoundError, ValueError):
+            continue
+
+        at = entry["answer_at"]
+        if at >= len(chat_messages) or chat_messages[at]["role"] != "assistant":
+            continue
+
+        related.append({
+            "chat_id": entry["chat_id"],
+            "question": chat_messages[at - 1]["content"],
+            "answer": chat_messages[at]["content"],
+            "score": float(scores[i]),
+        })
+        if len(related) == k:
+            break
+
+    return related
+
+
+def render_related_answers(related, lookup_ms):
+    """
+    Show related past answers in a collapsible box.
+    """
+    with st.expander(f"🔁 Related past answers ({len(related)}, {lookup_ms:.0f} ms)"):
+        for item in related:
+            st.markdown(f"**Q:** {item['question']}")
+            st.markdown(item["answer"])
+            st.divider()
+
+
+def related_context_message(related):
+    """
+    Compact system message with related past answers.
+    """
+    parts = ["Related answers from earlier chats (use only if relevant):"]
+    for item in related:
+        parts.append(f"Q: {item['question']}\nA: {item['answer'][:RELATED_CONTEXT_CHARS]}")
+    return {"role": "system", "content": "\n\n".join(parts)}
 
 
 # ==============================
 # 🔄 Stream AI Response
 # ==============================
 
-def stream_chat_with_ai(messages, placeholder, temperature, model):
+def to_api_messages(messages):
+    """
+    Strip stored metadata (e.g. the truncated flag) so only
+    role + content is sent to the API.
+    """
+    return [{"role": m["role"], "content": m["content"]} for m in messages]
+
+
+def new_usage(model):
+    """
+    Empty usage stats for one reply.
+    """
+    return {
+        "model": model,
+        "new_chat": False,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "latency_seconds": 0.0,
+        "ttft_seconds": None,
+        "refusal": False,
+    }
+
+
+def stream_chat_with_ai(messages, placeholder, temperature, model, on_cancel=None):
     """
     Stream response token-by-token from OpenAI.
     Display live output in Streamlit.
-    """
-    stream = client.responses.create(
-        model=model,
-        input=messages,
-        temperature=temperature,
-        stream=True
-    )
+    Returns the reply and its usage stats.
 
-    full_response = ""
+    The stream runs on the worker pool; this loop redraws the
+    placeholder at least every STREAM_POLL_SECONDS, so a Stop click
+    is handled even while the model is thinking or silent.
+
+    If the run is interrupted (Stop button, page reload), the
+    upstream stream is closed and on_cancel(partial, usage) is called.
+    API and network errors propagate.
+    """
+    start = time.perf_counter()
+    events = queue.Queue()
+    cancel = threading.Event()
 
-    for event in stream:
-        # Check for streaming text token
-        if event.type == "response.output_text.delta":
-            token = event.delta
-            full_response += token
-            placeholder.markdown(full_response)
+    get_stream_pool().submit(stream_to_queue, messages, temperature, model, events, cancel)
 
-    return full_response
+    full_response = ""
+    deltas = 0
+
+    try:
+        while True:
+            try:
+                kind, _, payload = events.get(timeout=STREAM_POLL_SECONDS)
+            except queue.Empty:
+                # Nothing new: touch the placeholder anyway
+                if full_response:
+                    placeholder.markdown(full_response)
+                else:
+                    placeholder.caption(f"⏳ {time.perf_counter() - start:.1f}s")
+                continue
+
+            if kind == "delta":
+                full_response = payload
+                deltas += 1
+                # Each delta carries the whole reply so far: skip
+                # redraws the next queued delta would replace
+                if events.empty():
+                    placeholder.markdown(full_response)
+            elif kind == "error":
+                raise payload
+            else:
+                placeholder.markdown(payload["reply"])
+                return payload["reply"], payload["usage"]
+
+    # Streamlit interrupts the script with a ScriptControlException
+    # when the app reruns (Stop button) or the session goes away
+    except (ScriptControlException, KeyboardInterrupt):
+        # The worker closes the upstream stream at its next event
+        cancel.set()
+
+        usage = new_usage(model)
+        usage["truncated"] = True
+        usage["output_tokens"] = deltas  # ~1 token per delta; no usage event yet
+        usage["latency_seconds"] = time.perf_counter() - start
+
+        if on_cancel is not None:
+            on_cancel(full_response, usage)
+        raise
 
 
 # ==============================
-# 🎨 Streamlit Page Config
+# 🧵 Stream Workers
 # ==============================
 
-st.set_page_config(page_title="PyMentor", layout="centered")
+# Worker threads shared by all sessions for model streams
+# (one per chat reply, one per model in compare mode)
+STREAM_POOL_SIZE = 32
 
-st.title("🐍 PyMentor - Python Tutor ChatBot")
-st.write("💡 Welcome To Your AI Powered Python Assistant")
-st.caption("🧚‍♀️ Chat Titles | 💬 Streaming | 🔄 Resume Chat | 🎮 Controls | 🤹 Multiple Chats")
+# Max seconds between UI updates while waiting for a stream
+# (each update is a point where a Stop click can interrupt the run)
+STREAM_POLL_SECONDS = 0.25
+
+
+@st.cache_resource
+def get_stream_pool():
+    """
+    Process-wide thread pool for concurrent model streams.
+    """
+    return ThreadPoolExecutor(max_workers=STREAM_POOL_SIZE, thread_name_prefix="stream")
+
+
+def stream_to_queue(messages, temperature, model, events, cancel):
+    """
+    Worker: stream one model's reply into a queue.
+    Runs off the script thread, so it never touches Streamlit.
+    """
+    # Queued behind other sessions' streams and stopped meanwhile
+    if cancel.is_set():
+        return
+
+    start = time.perf_counter()
+    usage = new_usage(model)
+    reply = ""
+
+    try:
+        stream = client.responses.create(
+            model=model,
+            input=to_api_messages(messages),
+            temperature=temperature,
+            stream=True
+        )
+
+        try:
+            for event in stream:
+                # The script run was interrupted (Stop, page reload)
+                if cancel.is_set():
+                    usage["truncated"] = True
+                    break
+
+                if event.type == "response.output_text.delta":
+                    if not reply:
+                        usage["ttft_seconds"] = time.perf_counter() - start
+                    reply += event.delta
+                    events.put(("delta", model, reply))
+
+                elif event.type == "response.refusal.delta":
+                    usage["refusal"] = True
+
+                elif event.type == "response.completed" and event.response.usage:
+                    usage["input_tokens"] = event.response.usage.input_tokens
+                    usage["output_tokens"] = event.response.usage.output_tokens
+
+        # Release the HTTP connection right away
+        finally:
+            stream.close()
+
+    except Exception as e:
+        events.put(("error", model, e))
+        return
+
+    usage["latency_seconds"] = time.perf_counter() - start
+    events.put(("done", model, {"reply": reply, "usage": usage}))
 
 
 # ==============================
-# ⚙️ Sidebar Settings
+# ⚖️ Model Comparison
 # ==============================
 
-st.sidebar.header("⚙️ Chat Settings")
+# Models offered in the sidebar (compare mode runs all of them)
+MODELS = ["gpt-5.1", "gpt-4.1-mini"]
 
-# Initialize session state for current chat
-if "current_chat" not in st.session_state:
-    st.session_state.current_chat = new_chat()
 
-# Load all chats
-chat_files = list_chats()
+def timing_caption(usage):
+    """
+    Short TTFT / duration summary for one reply.
+    """
+    duration = f"⏱ {usage['latency_seconds']:.2f}s"
+    if usage["ttft_seconds"] is None:
+        return duration
+    return f"⚡ TTFT {usage['ttft_seconds']:.2f}s | {duration}"
 
-# Store titles for dropdown display
-chat_titles = {}
 
-for f in chat_files:
-    data = load_chat(os.path.join(CHAT_DIR, f))
-    chat_titles[f] = data["title"]
+def compare_models(messages, temperature, is_new_chat=False):
+    """
+    Stream every model in MODELS at once, each into its own column.
+    Total wall time is about the slowest model, not the sum.
+    Usage of every reply is recorded as it arrives, kept or not.
+    """
+    events = queue.Queue()
+    cancel = threading.Event()
+    start = time.perf_counter()
+
+    placeholders = {}
+    captions = {}
+    for column, model in zip(st.columns(len(MODELS)), MODELS):
+        column.markdown(f"**{model}**")
+        placeholders[model] = column.empty()
+        captions[model] = column.empty()
+    progress = st.empty()
+
+    pool = get_stream_pool()
+    for model in MODELS:
+        pool.submit(stream_to_queue, messages, temperature, model, events, cancel)
+
+    results = {}
+
+    try:
+        while len(results) < len(MODELS):
+            # Wait for one event, then drain the backlog so each
+            # column is redrawn once per batch of tokens
+            try:
+                batch = [events.get(timeout=STREAM_POLL_SECONDS)]
+            except queue.Empty:
+                progress.caption(f"⏳ {time.perf_counter() - start:.1f}s")
+                continue
+
+            while True:
+                try:
+                    batch.append(events.get_nowait())
+                except queue.Empty:
+                    break
+
+            latest = {}
+            for kind, model, payload in batch:
+                if kind == "delta":
+                    latest[model] = payload
+                elif kind == "error":
+                    results[model] = {"reply": "", "usage": None, "error": str(payload)}
+                    placeholders[model].error(str(payload))
+                else:
+                    # The first reply of a new chat counts the chat once
+                    payload["usage"]["new_chat"] = is_new_chat and all(r["usage"] is None for r in results.values())
+                    record_usage(payload["usage"])
+
+                    results[model] = payload
+                    latest[model] = payload["reply"]
+                    captions[model].caption(timing_caption(payload["usage"]))
+
+            for model, reply in latest.items():
+                placeholders[model].markdown(reply)
+
+    # Script interrupted: tell the workers to close their streams
+    except BaseException:
+        cancel.set()
+        raise
+
+    wall = time.perf_counter() - start
+    durations = [r["usage"]["latency_seconds"] for r in results.values() if r["usage"]]
+    progress.caption(f"⏱ Total {wall:.2f}s (one after the other: ~{sum(durations):.2f}s)")
+
+    return results
+
+
+def render_compare_results(results):
+    """
+    Show compared replies side by side.
+    Returns the model whose reply the user chose to keep.
+    """
+    kept = None
 
-# Chat selection dropdown
-selected_chat = st.sidebar.selectbox(
-    "Select Chat",
-    chat_files,
-    index=chat_files.index(f"{st.session_state.current_chat}.json"),
-    format_func=lambda f: chat_titles[f]
-)
+    for column, model in zip(st.columns(len(results)), results):
+        result = results[model]
+        with column:
+            st.markdown(f"**{model}**")
+            if result["usage"] is None:
+                st.error(result["error"])
+                continue
 
-# If user switches chat
-if selected_chat.replace(".json", "") != st.session_state.current_chat:
-    st.session_state.current_chat = selected_chat.replace(".json", "")
-    st.rerun()
+            st.markdown(result["reply"])
+            st.caption(timing_caption(result["usage"]))
+            if st.button("✅ Keep This Answer", key=f"keep_{model}"):
+                kept = model
 
-# Create new chat button
-if st.sidebar.button("➕ New Chat"):
-    st.session_state.current_chat = new_chat()
-    st.rerun()
+    return kept
+
+
+# ==============================
+# 💬 Display Chat Messages
+# ==============================
 
-# Model selection
-model = st.sidebar.selectbox("Choose Model", ["gpt-5.1", "gpt-4.1-mini"])
+def render_message(msg):
+    """
+    Render one chat message the same way it was streamed.
+    """
+    with st.chat_message(msg["role"]):
+        st.markdown(msg["content"])
 
-# Temperature control
-temperature = st.sidebar.slider(
-    "Temperature",
-    min_value=0.0,
-    max_value=2.0,
-    value=0.7,
-    step=0.1
-)
+        if msg.get("truncated"):
+            st.caption("⏹ Stopped early")
 
 
 # ==============================
-# 📥 Load Current Chat
+# 🎨 Streamlit Page Config
 # ==============================
 
-chat_path = os.path.join(CHAT_DIR, f"{st.session_state.current_chat}.json")
-chat_data = load_chat(chat_path)
-messages = chat_data["messages"]
+st.set_page_config(page_title="PyMentor", layout="centered")
 
-# Count only user & assistant messages
-message_count = len([m for m in messages if m["role"] != "system"])
-st.sidebar.metric("💬 Messages", message_count)
+st.title("🐍 PyMentor - Python Tutor ChatBot")
+st.write("💡 Welcome To Your AI Powered Python Assistant")
+st.caption("🧚‍♀️ Chat Titles | 💬 Streaming | 🔄 Resume Chat | 🎮 Controls | 🤹 Multiple Chats")
 
 
 # ==============================
-# 💬 Display Chat Messages
+# 🗂 Sidebar: Chat List Fragment
 # ==============================
 
-for msg in messages:
-    if msg["role"] != "system":
-        st.chat_message(msg["role"]).markdown(msg["content"])
+@st.fragment
+def chat_list_fragment():
+    """
+    Chat selection, new chat and delete.
+    Each action changes the conversation, so it reruns the app,
+    but titles come from the index instead of every chat file.
+    """
+    with fragment_span("chat_list"):
+        with span("load_titles"):
+            chat_files, chat_titles = get_chat_titles()
+
+        # Another session deleted the chat open here
+        if f"{st.session_state.current_chat}.json" not in chat_files:
+            st.session_state.current_chat = new_chat()
+            rerun()
+
+        # Chat selection dropdown
+        selected_chat = st.selectbox(
+            "Select Chat",
+            chat_files,
+            index=chat_files.index(f"{st.session_state.current_chat}.json"),
+            format_func=lambda f: chat_titles[f]
+        )
+
+        # If user switches chat
+        if selected_chat.replace(".json", "") != st.session_state.current_chat:
+            st.session_state.current_chat = selected_chat.replace(".json", "")
+            rerun()
+
+        # Create new chat button
+        if st.button("➕ New Chat"):
+            st.session_state.current_chat = new_chat()
+            rerun()
+
+        # Delete current chat
+        if st.button("🗑️ Delete Chat"):
+            file_name = f"{st.session_state.current_chat}.json"
+            os.remove(os.path.join(CHAT_DIR, file_name))
+            remove_chat_title(file_name)
+            forget_chat_answers(st.session_state.current_chat)
+            st.session_state.current_chat = new_chat()
+            rerun()
 
 
 # ==============================
-# 📝 Chat Input Form
+# 🎮 Sidebar: Settings Fragment
 # ==============================
 
-with st.form("chat_form", clear_on_submit=True):
-    user_input = st.text_area(
-        "Ask a Python Question",
-        height=100,
-        placeholder="For eg: Explain Python List with examples"
-    )
-    submit = st.form_submit_button("Ask PyMentor")
+@st.fragment
+def settings_fragment():
+    """
+    Model, temperature and related-answers mode.
+    Values live in session state, so changing them
+    reruns nothing but this fragment.
+    """
+    with fragment_span("settings"):
+        # Model selection
+        st.selectbox("Choose Model", MODELS, key="model")
+
+        # Temperature control
+        st.slider(
+            "Temperature",
+            min_value=0.0,
+            max_value=2.0,
+            value=0.7,
+            step=0.1,
+            key="temperature"
+        )
+
+        # Related past answers
+        st.selectbox(
+            "Related Answers",
+            ["Show", "Inject as context", "Off"],
+            help="Look up similar questions from earlier chats before answering",
+            key="related_mode"
+        )
+
+        # Stream all models side by side
+        st.toggle("⚖️ Compare Models", key="compare_models")
 
 
 # ==============================
-# 🤖 Handle User Submission
+# 💬 Conversation Fragment
 # ==============================
 
-if submit and user_input.strip():
+@st.fragment
+def conversation_fragment():
+    """
+    Message history, input form and streaming.
+    Asking a question reruns only this fragment.
+    """
+    with fragment_span("conversation"):
+        conversation()
+
+
+def keep_compared_answer(chat_path, chat_data, pending, kept):
+    """
+    Save the question and the chosen compared answer.
+    """
+    messages = chat_data["messages"]
+    reply = pending["results"][kept]["reply"]
+
+    messages.append({
+        "role": "user",
+        "content": pending["question"]
+    })
+    messages.append({
+        "role": "assistant",
+        "content": reply
+    })
+
+    title_changed = chat_data["title"] != pending["title"]
+    chat_data["title"] = pending["title"]
+
+    # Usage was recorded when the answers arrived (compare_models)
+    with span("save_chat"):
+        save_chat(chat_path, chat_data)
+        index_answer(st.session_state.current_chat, messages)
+
+    del st.session_state.pending_compare
+    rerun(scope="app" if title_changed else "fragment")
+
+
+def conversation():
+    """
+    Load the current chat, render it and handle a new question.
+    """
+    chat_path = os.path.join(CHAT_DIR, f"{st.session_state.current_chat}.json")
+
+    # Stop starts this run while the interrupted one may still be
+    # saving its partial reply (held until the reply is saved)
+    reply_lock = st.session_state.setdefault("reply_lock", threading.Lock())
+    with reply_lock, span("load_chat"):
+        chat_data = load_chat(chat_path)
+    messages = chat_data["messages"]
+
+    # Count only user & assistant messages
+    message_count = len([m for m in messages if m["role"] != "system"])
+    st.caption(f"💬 Messages: {message_count}")
+
+    # Display chat messages
+    with span("render_messages"):
+        for msg in messages:
+            if msg["role"] != "system":
+                render_message(msg)
+
+    # Related answers found for the last question in this chat
+    last_related = st.session_state.get("related_answers")
+    if last_related and last_related["chat"] == st.session_state.current_chat:
+        render_related_answers(last_related["items"], last_related["lookup_ms"])
+
+    # Side-by-side answers waiting for the user to pick one
+    pending = st.session_state.get("pending_compare")
+    if pending and pending["chat"] == st.session_state.current_chat:
+        st.chat_message("user").markdown(pending["question"])
+        kept = render_compare_results(pending["results"])
+        if kept:
+            keep_compared_answer(chat_path, chat_data, pending, kept)
+
+    # Chat input form
+    with st.form("chat_form", clear_on_submit=True):
+        user_input = st.text_area(
+            "Ask a Python Question",
+            height=100,
+            placeholder="For eg: Explain Python List with examples"
+        )
+        submit = st.form_submit_button("Ask PyMentor")
+
+    if not (submit and user_input.strip()):
+        return
+
+    model = st.session_state.model
+    temperature = st.session_state.temperature
+    related_mode = st.session_state.related_mode
 
     # Show user message
     st.chat_message("user").markdown(user_input)
-    messages.append({"role": "user", "content": user_input})
+    messages.append({
+        "role": "user",
+        "content": user_input
+    })
 
     # Generate title if first message
+    title_changed = False
     if chat_data["title"] == "New Chat":
-        chat_data["title"] = generate_chat_title(user_input)
+        with span("generate_title"):
+            try:
+                chat_data["title"] = generate_chat_title(user_input)
+                title_changed = True
+            except Exception:
+                # Keep "New Chat"; pymentor_backfill_titles.py fills it in later
+                st.toast("🏷 Could not generate a title for this chat")
+
+    # Look up similar past answers
+    api_messages = messages
+    st.session_state.pop("related_answers", None)
+    if related_mode != "Off":
+        lookup_start = time.perf_counter()
+        with span("related_lookup"):
+            related = find_related_answers(user_input, exclude_chat=st.session_state.current_chat)
+        lookup_ms = (time.perf_counter() - lookup_start) * 1000
+
+        if related and related_mode == "Show":
+            render_related_answers(related, lookup_ms)
+
+            # Keep them visible after the rerun
+            st.session_state.related_answers = {
+                "chat": st.session_state.current_chat,
+                "items": related,
+                "lookup_ms": lookup_ms,
+            }
 
-    # Display assistant response
-    with st.chat_message("assistant"):
+        elif related:
+            api_messages = messages[:-1] + [related_context_message(related)] + messages[-1:]
+
+    # A new question replaces any comparison still waiting for a pick
+    st.session_state.pop("pending_compare", None)
+
+    if st.session_state.compare_models:
+        with span("compare"):
+            is_new_chat = len([m for m in messages if m["role"] == "user"]) == 1
+            results = compare_models(api_messages, temperature, is_new_chat=is_new_chat)
+
+        # Nothing is saved until the user keeps one answer
+        st.session_state.pending_compare = {
+            "chat": st.session_state.current_chat,
+            "question": user_input,
+            "title": chat_data["title"],
+            "results": results,
+        }
+        rerun(scope="fragment")
+
+    # Held until the reply (full or partial) is saved
+    with reply_lock:
+        # Display assistant response
+        with st.chat_message("assistant"):
+
+            # Typing indicator
+            typing = st.empty()
+            typing.markdown("⌛ PyMentor Is Typing...")
+            time.sleep(0.5)
+
+            st.caption("Press ⏹ Stop Answer in the sidebar to end this answer early.")
+
+            placeholder = st.empty()
+
+            def save_partial_reply(partial, usage):
+                """
+                Keep what was streamed so far, flagged as truncated.
+                Runs after Streamlit stopped the script, so it must not
+                call st.* (that would raise the stop again).
+                """
+                messages.append({
+                    "role": "assistant",
+                    "content": partial,
+                    "truncated": True
+                })
+                estimate_savings(usage)
+                usage["new_chat"] = len([m for m in messages if m["role"] == "user"]) == 1
+                save_chat(chat_path, chat_data, usage=usage)
+
+            # Stream response
+            with span("stream"):
+                ai_reply, usage = stream_chat_with_ai(
+                    api_messages,
+                    placeholder,
+                    temperature=temperature,
+                    model=model,
+                    on_cancel=save_partial_reply
+                )
 
-        # Typing indicator
-        typing = st.empty()
-        typing.markdown("⌛ PyMentor Is Typing...")
-        time.sleep(0.5)
+            typing.write("")
 
-        placeholder = st.empty()
+        # Save assistant message
+        messages.append({
+            "role": "assistant",
+            "content": ai_reply
+        })
 
-        # Stream response
-        ai_reply = stream_chat_with_ai(
-            messages,
-            placeholder,
-            temperature=temperature,
-            model=model
-        )
+        # First turn of this chat counts as a new chat
+        usage["new_chat"] = len([m for m in messages if m["role"] == "user"]) == 1
+        with span("save_chat"):
+            save_chat(chat_path, chat_data, usage=usage)
+            index_answer(st.session_state.current_chat, messages)
 
-        typing.write("")
+    # The sidebar only needs to refresh when the chat got a new title
+    rerun(scope="app" if title_changed else "fragment")
 
-    # Save assistant message
-    messages.append({"role": "assistant", "content": ai_reply})
-    save_chat(chat_path, chat_data)
 
-    st.rerun()
+# ==============================
+# ⚙️ Sidebar Settings
+# ==============================
+
+st.sidebar.header("⚙️ Chat Settings")
+
+# Initialize session state for current chat
+if "current_chat" not in st.session_state:
+    st.session_state.current_chat = new_chat()
+
+with st.sidebar:
+    chat_list_fragment()
+    settings_fragment()
+
+    # Outside all fragments on purpose: only a full-app rerun interrupts
+    # a running fragment. A click on a widget inside a fragment waits
+    # until the stream has finished.
+    st.button("⏹ Stop Answer", help="Stop the answer being streamed and keep what arrived so far")
+
+# Usage analytics dashboard
+show_analytics = st.sidebar.toggle("📊 Usage Analytics")
+
+# Admin profiling panel
+if SPANS_ENABLED:
+    render_admin_panel()
+
 
 
 # ==============================
-# 🗑 Delete Chat
+# 📊 Analytics Page
 # ==============================
 
-if st.sidebar.button("🗑️ Delete Chat"):
-    os.remove(chat_path)
-    st.session_state.current_chat = new_chat()
-    st.rerun()
+if show_analytics:
+    render_analytics_dashboard()
+    finish_run()
+    st.stop()
+
+
+# ==============================
+# 💬 Chat Page
+# ==============================
+
+conversation_fragment()
+
+
+finish_run()